@@ -3,30 +3,62 @@ import os
 from pathlib import Path
 from dotenv import load_dotenv
 
-# Load environment variables from .env file
-env_path = Path(__file__).parent / '.env'
-load_dotenv(dotenv_path=env_path)
+# HTTP request timeout (seconds), shared by every bridge request
+REQUEST_TIMEOUT = 2  # Reduced from 5 to speed up fallback on wrong endpoint
+
+# Load environment variables from .env file (once per process)
+_LOADED = False
+
+
+def _load_env():
+    """Load the .env file if it hasn't been loaded yet."""
+    global _LOADED
+    if not _LOADED:
+        env_path = Path(__file__).parent / '.env'
+        load_dotenv(dotenv_path=env_path)
+        _LOADED = True
+
+
+def _parse_setting(name, value, type_):
+    """Convert a numeric .env setting, with a clear error for bad values."""
+    try:
+        return type_(value)
+    except ValueError:
+        kind = "a number" if type_ is float else "a whole number"
+        raise ValueError(f"{name} in .env file must be {kind}, got {value!r}") from None
 
 
 class Config:
     """Configuration settings for the Hue Randomizer."""
 
-    # Bridge settings
-    HUE_BRIDGE_HOST = os.getenv('HUE_BRIDGE_HOST')
-    HUE_API_KEY = os.getenv('HUE_API_KEY')
+    def __init__(self):
+        """Read settings from the environment once."""
+        _load_env()
+
+        # Bridge settings
+        self.HUE_BRIDGE_HOST = os.getenv('HUE_BRIDGE_HOST')
+        self.HUE_API_KEY = os.getenv('HUE_API_KEY')
+
+        # API base URL (CLIP v2)
+        self.BASE_URL = f"https://{self.HUE_BRIDGE_HOST}/clip/v2"
+
+        # Effect settings (raw strings; converted by validate() so --help can't fail on them)
+        self.EFFECT_DURATION = os.getenv('EFFECT_DURATION', '10')  # Seconds
+        self.TRANSITION_TIME = os.getenv('TRANSITION_TIME', '0')  # Deciseconds, 0 = instant
 
-    # API base URL (CLIP v2)
-    @property
-    def BASE_URL(self):
-        """Construct the base API URL for CLIP v2."""
-        return f"https://{self.HUE_BRIDGE_HOST}/clip/v2"
+        self._validated = False
 
     def validate(self):
         """Validate that all required settings are present."""
+        if self._validated:
+            return
         if not self.HUE_BRIDGE_HOST:
             raise ValueError("HUE_BRIDGE_HOST not set in .env file")
         if not self.HUE_API_KEY:
             raise ValueError("HUE_API_KEY not set in .env file")
+        self.EFFECT_DURATION = _parse_setting('EFFECT_DURATION', self.EFFECT_DURATION, float)
+        self.TRANSITION_TIME = _parse_setting('TRANSITION_TIME', self.TRANSITION_TIME, int)
+        self._validated = True
 
 
 # Global config instance
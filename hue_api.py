@@ -1,16 +1,48 @@
 """Philips Hue CLIP v2 API client classes."""
+import json
 import logging
+import socket
+from concurrent.futures import ThreadPoolExecutor
 import requests
 import urllib3
-from config import config
+from config import config, REQUEST_TIMEOUT
 
 logger = logging.getLogger(__name__)
 
-# Disable SSL warnings for self-signed certificate
+# Disable SSL warnings for self-signed certificate (once, for every client)
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
-# HTTP request timeout (seconds)
-REQUEST_TIMEOUT = 2  # Reduced from 5 to speed up fallback on wrong endpoint
+# Groups up to this size fetch light states with parallel per-light GETs
+# instead of downloading every light on the bridge
+PARALLEL_GET_MAX_LIGHTS = 8
+
+# Compact JSON separators (no whitespace in request bodies)
+JSON_SEPARATORS = (',', ':')
+
+# Bodies are pre-encoded (see encode_state), so each PUT declares JSON itself;
+# this also covers sessions passed in by callers
+JSON_HEADERS = {'Content-Type': 'application/json'}
+
+
+# Socket options for bridge connections: send small PUTs immediately (no Nagle
+# delay) and keep idle pooled connections from being silently dropped
+SOCKET_OPTIONS = [
+    (socket.IPPROTO_TCP, socket.TCP_NODELAY, 1),
+    (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+]
+
+
+def encode_state(state):
+    """Serialize a CLIP v2 state dict to a compact JSON request body."""
+    return json.dumps(state, separators=JSON_SEPARATORS).encode()
+
+
+class BridgeAdapter(requests.adapters.HTTPAdapter):
+    """HTTPAdapter that applies SOCKET_OPTIONS to every pooled connection."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs['socket_options'] = SOCKET_OPTIONS
+        super().init_poolmanager(*args, **kwargs)
 
 
 class HueClient:
@@ -38,16 +70,17 @@ class HueClient:
             self.session.verify = False  # Skip SSL verification for local bridge
 
             # Configure connection pooling for better performance
-            adapter = requests.adapters.HTTPAdapter(
-                pool_connections=10,
-                pool_maxsize=20,
+            adapter = BridgeAdapter(
+                pool_connections=1,  # Only one host (the bridge) is ever contacted
+                pool_maxsize=20,  # Covers the send, restore and parallel GET workers
                 max_retries=0  # Disable retries for faster failures
             )
             self.session.mount('https://', adapter)
 
-            # Set up CLIP v2 authentication header
+            # Set up CLIP v2 authentication header and keep connections alive
             self.session.headers.update({
-                'hue-application-key': config.HUE_API_KEY
+                'hue-application-key': config.HUE_API_KEY,
+                'Connection': 'keep-alive'
             })
 
             HueClient._shared_session = self.session
@@ -174,6 +207,14 @@ class RoomAPI(HueClient):
 class LightAPI(HueClient):
     """API methods for Hue lights."""
 
+    def __init__(self, session=None):
+        super().__init__(session)
+        self._light_url_prefix = self.base_url + '/resource/light/'
+
+    def light_url(self, light_id):
+        """Get the resource URL of a light (can be reused across PUTs)."""
+        return self._light_url_prefix + light_id
+
     def get_all_lights(self):
         """Get all lights' states in a single batch request."""
         url = f"{self.base_url}/resource/light"
@@ -188,6 +229,43 @@ class LightAPI(HueClient):
             logger.error(f"API error getting lights: {e}")
             raise
 
+    def get_lights(self, light_ids):
+        """Get the states of specific lights.
+
+        Small sets (up to PARALLEL_GET_MAX_LIGHTS) are fetched with parallel
+        per-light GETs; larger ones with get_all_lights(), keeping only the
+        requested lights.
+
+        Returns:
+            dict: light ID -> state for the requested lights found on the bridge
+        """
+        wanted = set(light_ids)
+        if not wanted:
+            return {}
+        if len(wanted) <= PARALLEL_GET_MAX_LIGHTS:
+            return self._get_lights_parallel(wanted)
+
+        all_lights = self.get_all_lights()
+        lights_dict = {light_id: all_lights[light_id] for light_id in wanted if light_id in all_lights}
+        logger.debug(f"Retrieved {len(lights_dict)}/{len(wanted)} requested lights")
+        return lights_dict
+
+    def _get_lights_parallel(self, light_ids):
+        """Fetch each light with its own GET, all in flight at once."""
+        with ThreadPoolExecutor(max_workers=len(light_ids)) as executor:
+            futures = {light_id: executor.submit(self.get_light, light_id) for light_id in light_ids}
+
+        lights_dict = {}
+        for light_id, future in futures.items():
+            try:
+                lights_dict[light_id] = future.result()
+            except requests.exceptions.HTTPError as e:
+                if e.response is not None and e.response.status_code == 404:
+                    continue  # Light isn't on the bridge; caller reports it as missing
+                raise
+        logger.debug(f"Retrieved {len(lights_dict)}/{len(light_ids)} requested lights")
+        return lights_dict
+
     def get_light(self, light_id):
         """Get the current state of a single light."""
         url = f"{self.base_url}/resource/light/{light_id}"
@@ -199,75 +277,97 @@ class LightAPI(HueClient):
                 return data['data'][0]
             logger.warning(f"No data returned for light {light_id}")
             raise Exception(f"No data returned for light {light_id}")
+        except requests.exceptions.HTTPError as e:
+            if e.response is not None and e.response.status_code == 404:
+                # Expected for lights that aren't on the bridge; get_lights() reports them as missing
+                logger.debug(f"Light {light_id} not found: {e}")
+            else:
+                logger.error(f"API error getting light {light_id}: {e}")
+            raise
         except requests.exceptions.RequestException as e:
             logger.error(f"API error getting light {light_id}: {e}")
             raise
 
-    def set_light_state(self, light_id, state):
-        """Set the state of a single light using CLIP v2.
-
-        Converts v1-style state dict to CLIP v2 format.
-        """
-        url = f"{self.base_url}/resource/light/{light_id}"
-
-        # Convert v1 state format to CLIP v2 format
-        v2_state = {}
-
-        # Handle on/off
-        if 'on' in state:
-            v2_state['on'] = {'on': state['on']}
-
-        # Handle brightness (bri -> dimming)
-        if 'bri' in state:
-            v2_state['dimming'] = {'brightness': round((state['bri'] / 254) * 100, 2)}
+    def set_light_state(self, light_id, state, url=None):
+        """Set the state of a single light using a CLIP v2 state dict.
 
-        # Handle color - convert hue/sat to xy
-        if 'hue' in state and 'sat' in state:
-            # Simplified conversion for blue and yellow
-            hue = state['hue']
-            BLUE_HUE = 46920
-            YELLOW_HUE = 12750
-
-            if hue == BLUE_HUE:
-                v2_state['color'] = {'xy': {'x': 0.1691, 'y': 0.0441}}  # Blue
-            elif hue == YELLOW_HUE:
-                v2_state['color'] = {'xy': {'x': 0.5, 'y': 0.5}}  # Yellow
-            else:
-                # Generic conversion
-                v2_state['color'] = {'xy': {'x': 0.3, 'y': 0.3}}
+        Args:
+            light_id: The light ID
+            state: CLIP v2 state dict
+            url: Optional precomputed light_url(light_id) for hot loops
 
-        # Handle color temperature
-        if 'ct' in state:
-            v2_state['color_temperature'] = {'mirek': state['ct']}
+        Returns:
+            bool: True if the bridge accepted the state
+        """
+        return self.set_light_state_raw(light_id, encode_state(state), url)
 
-        # Handle xy color
-        if 'xy' in state:
-            v2_state['color'] = {'xy': {'x': state['xy'][0], 'y': state['xy'][1]}}
+    def set_light_state_raw(self, light_id, body, url=None):
+        """Set the state of a single light from a pre-encoded JSON body.
 
-        # Dynamics/transition - CLIP v2 uses duration in ms
-        if 'transitiontime' in state:
-            duration_ms = state['transitiontime'] * 100
-            v2_state['dynamics'] = {'duration': duration_ms}
+        Args:
+            light_id: The light ID
+            body: CLIP v2 state already serialized with encode_state()
+            url: Optional precomputed light_url(light_id) for hot loops
 
+        Returns:
+            bool: True if the bridge accepted the state
+        """
+        url = url or self._light_url_prefix + light_id
         try:
-            response = self.session.put(url, json=v2_state, timeout=REQUEST_TIMEOUT)
+            response = self.session.put(url, data=body, headers=JSON_HEADERS, timeout=REQUEST_TIMEOUT)
             response.raise_for_status()
-            return response.json()
+            # Response body isn't needed; release the connection without parsing it
+            response.close()
+            return True
         except requests.exceptions.RequestException as e:
             logger.warning(f"Failed to set state for light {light_id}: {e}")
             # Don't raise - continue the effect
+            return False
 
 
 class GroupedLightAPI(HueClient):
     """API methods for Hue grouped lights (rooms/zones)."""
 
-    def set_grouped_light_state(self, grouped_light_id, state):
-        """Set the state of a grouped light (all lights in room/zone at once)."""
-        url = f"{self.base_url}/resource/grouped_light/{grouped_light_id}"
+    def __init__(self, session=None):
+        super().__init__(session)
+        self._grouped_light_url_prefix = self.base_url + '/resource/grouped_light/'
+
+    def grouped_light_url(self, grouped_light_id):
+        """Get the resource URL of a grouped light (can be reused across PUTs)."""
+        return self._grouped_light_url_prefix + grouped_light_id
+
+    def set_grouped_light_state(self, grouped_light_id, state, url=None):
+        """Set the state of a grouped light (all lights in room/zone at once).
+
+        Args:
+            grouped_light_id: The grouped_light ID
+            state: CLIP v2 state dict
+            url: Optional precomputed grouped_light_url(grouped_light_id) for hot loops
+
+        Returns:
+            bool: True if the bridge accepted the state
+        """
+        return self.set_grouped_light_state_raw(grouped_light_id, encode_state(state), url)
+
+    def set_grouped_light_state_raw(self, grouped_light_id, body, url=None):
+        """Set the state of a grouped light from a pre-encoded JSON body.
+
+        Args:
+            grouped_light_id: The grouped_light ID
+            body: CLIP v2 state already serialized with encode_state()
+            url: Optional precomputed grouped_light_url(grouped_light_id) for hot loops
+
+        Returns:
+            bool: True if the bridge accepted the state
+        """
+        url = url or self._grouped_light_url_prefix + grouped_light_id
         try:
-            response = self.session.put(url, json=state, timeout=REQUEST_TIMEOUT)
+            response = self.session.put(url, data=body, headers=JSON_HEADERS, timeout=REQUEST_TIMEOUT)
             response.raise_for_status()
-            return response.json()
+            # Response body isn't needed; release the connection without parsing it
+            response.close()
+            return True
         except requests.exceptions.RequestException as e:
             logger.warning(f"Failed to set grouped light {grouped_light_id}: {e}")
-            # Don't raise - this is just for instant start
+            # Don't raise - callers fall back to per-light requests
+            return False
@@ -1,16 +1,17 @@
 #!/usr/bin/env python3
 """The Randomizer - Blue/Yellow desynchronized light effect."""
+import heapq
 import json
 import random
+import re
 import time
 import threading
 import signal
 import sys
 import atexit
 import logging
-import urllib3
-import requests
-from hue_api import ZoneAPI, RoomAPI, LightAPI, GroupedLightAPI
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import partial
 from config import config
 
 # Configure logging with millisecond precision
@@ -21,17 +22,84 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Disable SSL warnings for self-signed certificate
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-
-# Color definitions (hue/saturation for v1-style state dict)
-BLUE_HUE = 46920  # 65% of 65535
-YELLOW_HUE = 12750  # 19% of 65535
-MAX_SATURATION = 254
+# Color definitions (CIE xy for CLIP v2)
+BLUE_XY = (0.1691, 0.0441)
+YELLOW_XY = (0.5, 0.5)
 MAX_BRIGHTNESS = 254
 
+# Neutral white fallback when a light has no color to restore (mirek)
+DEFAULT_MIREK = 447
+
 # Timing constants (in seconds)
+MIN_FIRST_COLOR_REDUCTION = 0.1  # Minimum random offset for desynchronization
 MAX_FIRST_COLOR_REDUCTION = 2.0  # Maximum random offset for desynchronization
+GROUPS_CACHE_TTL = 30  # How long a fetched room/zone listing is reused
+
+# Maximum parallel per-light restore requests
+MAX_RESTORE_WORKERS = 10
+
+# Maximum parallel color-change requests during the effect
+MAX_SEND_WORKERS = 8
+
+# CLIP v2 resource IDs are lowercase UUIDs
+_UUID_RE = re.compile(r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$')
+
+
+def color_state(xy, brightness=MAX_BRIGHTNESS, transition_ms=0):
+    """Build the CLIP v2 state for one effect color.
+
+    Args:
+        xy: (x, y) color coordinates
+        brightness: Brightness level (0-254)
+        transition_ms: Fade time in milliseconds (0 = instant)
+    """
+    return {
+        "on": {"on": True},
+        "dimming": {"brightness": round((brightness / 254) * 100, 2)},
+        "color": {"xy": {"x": xy[0], "y": xy[1]}},
+        "dynamics": {"duration": transition_ms}
+    }
+
+
+def state_xy(state):
+    """Get the (x, y) color of a CLIP v2 light state, or None if it has none."""
+    xy = state.get('color', {}).get('xy')
+    return (xy.get('x'), xy.get('y')) if xy else None
+
+
+def _state_key(state):
+    """Hashable summary of the parts of a light state that get restored.
+
+    Returns:
+        tuple: (on, brightness, xy, mirek)
+    """
+    return (
+        state.get('on', {}).get('on', True),
+        state.get('dimming', {}).get('brightness'),
+        state_xy(state),
+        state.get('color_temperature', {}).get('mirek')
+    )
+
+
+def restore_state(key):
+    """Build the CLIP v2 restore state for a _state_key() tuple."""
+    on, brightness, xy, mirek = key
+    restore_data = {
+        "on": {"on": on},
+        "dynamics": {"duration": 0}  # Instant restore
+    }
+
+    # Restore brightness
+    if brightness is not None:
+        restore_data['dimming'] = {"brightness": brightness}
+
+    # Restore color based on what's available, defaulting to neutral white
+    if xy:
+        restore_data['color'] = {"xy": {"x": xy[0], "y": xy[1]}}
+    else:
+        restore_data['color_temperature'] = {"mirek": mirek or DEFAULT_MIREK}
+
+    return restore_data
 
 
 class HueRandomizer:
@@ -41,14 +109,33 @@ class HueRandomizer:
         """Initialize the randomizer with configuration."""
         config.validate()
 
-        # Initialize API clients
+        # Deferred import: requests/urllib3 dominate startup time
+        from hue_api import ZoneAPI, RoomAPI, LightAPI, GroupedLightAPI
+
+        # Initialize API clients on one pooled keep-alive session
         self.zone_api = ZoneAPI()
-        self.room_api = RoomAPI()
-        self.light_api = LightAPI()
-        self.grouped_light_api = GroupedLightAPI()
+        self.session = self.zone_api.session
+        self.room_api = RoomAPI(session=self.session)
+        self.light_api = LightAPI(session=self.session)
+        self.grouped_light_api = GroupedLightAPI(session=self.session)
+
+        # Close pooled connections cleanly on exit
+        atexit.register(self.session.close)
+
+        # Cached room/zone listing and name index (see get_groups)
+        self._groups_cache = None
+        self._groups_cache_ts = 0
+        self._groups_by_name = {}
 
     def get_groups(self):
-        """Get all available groups/rooms/zones."""
+        """Get all available groups/rooms/zones.
+
+        The listing is cached for GROUPS_CACHE_TTL seconds so a name lookup
+        followed by an error listing only hits the bridge once.
+        """
+        if self._groups_cache is not None and (time.monotonic() - self._groups_cache_ts) < GROUPS_CACHE_TTL:
+            return self._groups_cache
+
         groups = {}
         groups.update(self.room_api.get_all_rooms())
         groups.update(self.zone_api.get_all_zones())
@@ -56,6 +143,14 @@ class HueRandomizer:
         if not groups:
             raise Exception("No groups found")
 
+        # Index by lowercase name for find_group_by_name (first match wins)
+        groups_by_name = {}
+        for group_id, group_data in groups.items():
+            groups_by_name.setdefault(group_data.get('name', '').lower(), (group_id, group_data.get('type')))
+
+        self._groups_cache = groups
+        self._groups_cache_ts = time.monotonic()
+        self._groups_by_name = groups_by_name
         return groups
 
     def find_group_by_name(self, name):
@@ -64,21 +159,23 @@ class HueRandomizer:
         Returns:
             tuple: (group_id, group_type) or (None, None) if not found
         """
-        groups = self.get_groups()
-        name_lower = name.lower()
-        for group_id, group_data in groups.items():
-            if group_data.get('name', '').lower() == name_lower:
-                return group_id, group_data.get('type')
-        return None, None
+        self.get_groups()  # Refreshes the name index if the cache is stale
+        return self._groups_by_name.get(name.lower(), (None, None))
 
     def get_group_state(self, group_id, group_type=None):
         """Get the current state of a group.
 
         Args:
             group_id: The group UUID
-            group_type: Optional 'Room' or 'Zone' to skip trying both endpoints
+            group_type: Optional 'Room' or 'Zone' to skip trying both endpoints.
+                When omitted, the type is taken from the cached group listing
+                if one has been fetched.
         """
-        logger.debug(f"Getting group state for {group_id}, type={group_type}")
+        if group_type is None and self._groups_cache is not None:
+            # A group's type never changes, so even a stale listing is good enough
+            group_type = self._groups_cache.get(group_id, {}).get('type')
+
+        logger.debug("Getting group state for %s, type=%s", group_id, group_type)
 
         if group_type == 'Zone':
             return self.zone_api.get_zone(group_id)
@@ -99,113 +196,187 @@ class HueRandomizer:
         return self.light_api.set_light_state(light_id, state)
 
     def restore_light_state(self, light_id, original_state):
-        """Restore the original state of a light from CLIP v2 format."""
-        restore_data = {
-            "on": original_state.get('on', {}).get('on', True),
-            "transitiontime": 0  # Instant restore
-        }
+        """Restore the original state of a light from CLIP v2 format.
 
-        # Restore brightness
-        if 'dimming' in original_state:
-            bri_pct = original_state['dimming'].get('brightness', 100)
-            restore_data['bri'] = int((bri_pct / 100) * 254)
-
-        # Restore color based on what's available
-        if 'color' in original_state and 'xy' in original_state['color']:
-            xy = original_state['color']['xy']
-            restore_data['xy'] = [xy.get('x', 0.3), xy.get('y', 0.3)]
-        elif 'color_temperature' in original_state:
-            mirek = original_state['color_temperature'].get('mirek', 447)
-            restore_data['ct'] = mirek
-        else:
-            # Default to neutral white
-            restore_data['ct'] = 447
+        Returns:
+            bool: True if the bridge accepted the restore
+        """
+        return self.set_light_state(light_id, restore_state(_state_key(original_state)))
+
+    def restore_lights(self, original_states):
+        """Restore lights individually, sending the per-light PUTs in parallel.
+
+        Lights that had the same original state share one restore body, so
+        cleanup takes about one round trip instead of one per light.
+
+        Args:
+            original_states: Dict of light ID -> original CLIP v2 state
+
+        Returns:
+            list: IDs of lights whose restore request failed
+        """
+        from hue_api import encode_state
+
+        lights_by_key = {}
+        for light_id, original_state in original_states.items():
+            lights_by_key.setdefault(_state_key(original_state), []).append(light_id)
+        logger.debug("Restoring %d lights (%d distinct states)", len(original_states), len(lights_by_key))
+
+        with ThreadPoolExecutor(max_workers=min(len(original_states), MAX_RESTORE_WORKERS)) as executor:
+            futures = {}
+            for key, light_ids in lights_by_key.items():
+                restore_body = encode_state(restore_state(key))
+                for light_id in light_ids:
+                    futures[executor.submit(self.light_api.set_light_state_raw, light_id, restore_body)] = light_id
+
+            failed = []
+            for future, light_id in futures.items():
+                if not future.result():
+                    logger.error(f"Error restoring light {light_id}")
+                    failed.append(light_id)
+        return failed
+
+    def verify_restore(self, failed_states):
+        """Retry the restore of lights whose restore request failed.
+
+        A failed request may still have been applied (e.g. a timeout after the
+        bridge accepted it), so the lights are re-fetched first and only those
+        not back in their original state are restored again.
+
+        Args:
+            failed_states: Dict of light ID -> original CLIP v2 state, for the
+                lights whose restore request failed
+
+        Returns:
+            list: IDs of lights that had to be restored again
+        """
+        try:
+            current_states = self.light_api.get_lights(failed_states)
+        except Exception as e:
+            logger.warning(f"Could not verify restore: {e}")
+            return []
+
+        restored_again = []
+        for light_id, original_state in failed_states.items():
+            if light_id not in current_states:
+                logger.warning(f"Light {light_id} not found in bridge, cannot restore it")
+                continue
+            if _state_key(current_states[light_id]) != _state_key(original_state):
+                logger.debug("Light %s is not back in its original state, restoring again", light_id)
+                if self.restore_light_state(light_id, original_state):
+                    restored_again.append(light_id)
+                else:
+                    logger.error(f"Error restoring light {light_id}")
+
+        if restored_again:
+            logger.warning(f"Restored {len(restored_again)} lights again after a failed restore")
+        return restored_again
 
-        self.set_light_state(light_id, restore_data)
+    def _build_toggle_senders(self, cohorts, blue_body, yellow_body, grouped_light_id=None):
+        """Bind every color change PUT to its URL and body before the effect starts.
 
-    def control_light(self, light_id, duration, original_state, stop_event, effect_start_time, brightness=MAX_BRIGHTNESS, transition_interval=2):
-        """Control a single light with blue/yellow alternating pattern.
+        Args:
+            cohorts: Dict of first-switch offset -> list of light IDs (see run_schedule)
+            blue_body: Pre-encoded CLIP v2 body for blue
+            yellow_body: Pre-encoded CLIP v2 body for yellow
+            grouped_light_id: If set, a cohort spanning every light gets one
+                grouped_light PUT instead of one PUT per light
+
+        Returns:
+            list: Per cohort (in cohorts order), a (yellow, blue) pair of lists of
+                zero-argument senders, so it can be indexed by "switch to blue?"
+        """
+        total_lights = sum(len(light_ids) for light_ids in cohorts.values())
+
+        toggles = []
+        for light_ids in cohorts.values():
+            if grouped_light_id and len(light_ids) == total_lights:
+                send = self.grouped_light_api.set_grouped_light_state_raw
+                targets = [(grouped_light_id, self.grouped_light_api.grouped_light_url(grouped_light_id))]
+            else:
+                send = self.light_api.set_light_state_raw
+                targets = [(light_id, self.light_api.light_url(light_id)) for light_id in light_ids]
+            toggles.append(tuple(
+                [partial(send, resource_id, body, url) for resource_id, url in targets]
+                for body in (yellow_body, blue_body)
+            ))
+        return toggles
+
+    def run_schedule(self, cohorts, duration, stop_event, effect_start_ns, blue_body, yellow_body, grouped_light_id=None, transition_interval=2):
+        """Alternate every cohort between blue and yellow from a single scheduler thread.
+
+        A min-heap holds each cohort's next color change. Due changes are handed
+        to a bounded pool of MAX_SEND_WORKERS threads, so the thread count
+        stays constant no matter how many lights are in the group.
 
         Args:
-            light_id: The light ID to control
+            cohorts: Dict of first-switch offset (seconds after the effect start)
+                -> list of light IDs that switch together
             duration: Total duration of the effect
-            original_state: Original state to restore after
             stop_event: Threading event to signal when to stop
-            brightness: Brightness level (0-254, default 254)
+            effect_start_ns: Effect start time from time.monotonic_ns()
+            blue_body: Pre-encoded CLIP v2 body for blue (see color_state)
+            yellow_body: Pre-encoded CLIP v2 body for yellow
+            grouped_light_id: If set, a cohort spanning every light is switched
+                with one grouped_light PUT instead of one PUT per light
         """
-        # Random offset (0.1 - 2 seconds) for first yellow switch
-        first_yellow_offset = random.uniform(0.1, MAX_FIRST_COLOR_REDUCTION)
+        toggles = self._build_toggle_senders(cohorts, blue_body, yellow_body, grouped_light_id)
 
-        try:
-            # All lights start blue (already set by grouped_light)
-            # Wait for random offset before switching to yellow
-            if stop_event.wait(timeout=first_yellow_offset):
-                return  # stop_event was set, exit early
-
-            # Check if duration exceeded during the wait
-            if (time.time() - effect_start_time) >= duration:
-                return
-
-            # Now alternate between yellow and blue
-            is_blue = False  # Start with yellow since we're already blue
-
-            # Track when the next color change should happen
-            next_change_time = time.time() + transition_interval
-
-            while (time.time() - effect_start_time) < duration and not stop_event.is_set():
-                # Set color
-                color_state = {
-                    "on": True,
-                    "hue": BLUE_HUE if is_blue else YELLOW_HUE,
-                    "sat": MAX_SATURATION,
-                    "bri": brightness,
-                    "transitiontime": 0  # Instant color transitions
-                }
+        # Integer monotonic deadlines: immune to wall-clock jumps, no float churn
+        deadline_ns = effect_start_ns + int(duration * 1e9)
+        interval_ns = int(transition_interval * 1e9)
 
-                api_call_start = time.time()
-                self.set_light_state(light_id, color_state)
-                api_call_duration = time.time() - api_call_start
+        # (next change time, cohort index, switch to blue?) - all lights start blue
+        heap = [(effect_start_ns + int(offset * 1e9), index, False) for index, offset in enumerate(cohorts)]
+        heapq.heapify(heap)
 
-                # Check if we're past duration after the color change
-                if (time.time() - effect_start_time) >= duration:
+        senders = ThreadPoolExecutor(max_workers=MAX_SEND_WORKERS, thread_name_prefix='randomizer-send')
+        try:
+            while heap and not stop_event.is_set():
+                # One clock read per tick serves both the deadline and the wait
+                now_ns = time.monotonic_ns()
+                if now_ns >= deadline_ns:
                     break
 
-                # Toggle color for next iteration
-                is_blue = not is_blue
-
-                # Wait until next_change_time, accounting for API call duration
-                wait_until = next_change_time
-                next_change_time = wait_until + transition_interval
+                change_ns, index, is_blue = heap[0]
+                if change_ns > now_ns:
+                    # Sleep until the earliest change (or the end), waking early on stop
+                    if stop_event.wait(timeout=(min(change_ns, deadline_ns) - now_ns) / 1e9):
+                        break
+                    continue
 
-                time_to_wait = wait_until - time.time()
-                if time_to_wait > 0:
-                    remaining_time = duration - (time.time() - effect_start_time)
-                    actual_wait = min(time_to_wait, remaining_time)
-                    if stop_event.wait(timeout=actual_wait):
-                        break  # stop_event was set
+                for send in toggles[index][is_blue]:
+                    senders.submit(send)
+                heapq.heapreplace(heap, (change_ns + interval_ns, index, not is_blue))
 
         except Exception as e:
-            logger.error(f"Error controlling light {light_id}: {e}")
+            logger.error(f"Error running effect schedule: {e}")
 
-        # Don't restore here - let run_effect() handle batch restore at the end
+        finally:
+            # Drop color changes that haven't started so they can't land after restore
+            senders.shutdown(wait=True, cancel_futures=True)
 
-    def run_effect(self, group_id, duration=None, brightness=MAX_BRIGHTNESS, group_type=None, grouped_light_id_hint=None, transition_interval=2):
+    def run_effect(self, group_id, duration=None, brightness=MAX_BRIGHTNESS, group_type=None, grouped_light_id_hint=None, transition_interval=2, synchronized=False):
         """Run the randomizer effect on a group.
 
         Args:
             group_id: The group/room/zone ID or name
             duration: Duration in seconds (uses config default if None)
             brightness: Brightness level (0-254, default 254)
+            synchronized: Switch all lights together with one grouped_light PUT
+                per color change instead of desynchronized per-light PUTs
 
         Returns:
             dict: Status information about the effect
         """
+        from requests.exceptions import RequestException
+        from hue_api import encode_state
+
         if duration is None:
             duration = config.EFFECT_DURATION
 
         # Handle group name lookup (only if not a UUID)
-        # UUIDs contain dashes, names don't
-        if '-' not in str(group_id):
+        if not _UUID_RE.match(str(group_id).lower()):
             # This looks like a name, not an ID - do lookup
             found_id, found_type = self.find_group_by_name(str(group_id))
             if not found_id:
@@ -224,7 +395,7 @@ class HueRandomizer:
             group_data = self.get_group_state(group_id, group_type)
             group_name = group_data.get('name', f'Group {group_id}')
             light_ids = group_data.get('lights', [])
-            logger.debug(f"Group '{group_name}' has {len(light_ids)} lights")
+            logger.debug("Group '%s' has %d lights", group_name, len(light_ids))
 
             if not light_ids:
                 return {
@@ -232,22 +403,21 @@ class HueRandomizer:
                     "error": f"No lights found in group '{group_name}'",
                     "group_id": group_id
                 }
-        except requests.exceptions.RequestException as e:
+        except RequestException as e:
             return {
                 "success": False,
                 "error": f"Failed to get group state: {str(e)}",
                 "group_id": group_id
             }
 
-        # Get original states for all lights in a single batch request
+        # Get original states for all lights (parallel GETs or one batch request)
         original_states = {}
         unreachable_lights = []
 
         try:
-            all_lights = self.light_api.get_all_lights()
-            logger.debug(f"Retrieved states for {len(all_lights)} lights")
+            all_lights = self.light_api.get_lights(light_ids)
+            logger.debug("Retrieved states for %d lights", len(all_lights))
 
-            # Filter to only the lights in this group
             for light_id in light_ids:
                 if light_id not in all_lights:
                     logger.warning(f"Light {light_id} not found in bridge")
@@ -256,13 +426,13 @@ class HueRandomizer:
 
                 light_state = all_lights[light_id]
 
-                # Check if light is reachable
-                if light_state.get('owner', {}).get('rtype') != 'device':
-                    logger.debug(f"Light {light_id} ({light_state.get('metadata', {}).get('name')}) is not reachable, skipping")
+                # Check if light is reachable (assume reachable if the bridge omits the owner)
+                if light_state.get('owner', {}).get('rtype', 'device') != 'device':
+                    logger.debug("Light %s (%s) is not reachable, skipping", light_id, light_state.get('metadata', {}).get('name'))
                     unreachable_lights.append(light_id)
                 else:
                     original_states[light_id] = light_state
-                    logger.debug(f"Light {light_id} ({light_state.get('metadata', {}).get('name')}) ready")
+                    logger.debug("Light %s (%s) ready", light_id, light_state.get('metadata', {}).get('name'))
 
         except Exception as e:
             logger.error(f"Failed to get light states: {e}")
@@ -284,129 +454,139 @@ class HueRandomizer:
         # INSTANT START: Set all lights to blue using grouped_light for immediate visual feedback
         grouped_light_id = grouped_light_id_hint or group_data.get('grouped_light_id')
         if grouped_light_id:
-            logger.debug(f"Setting all lights to blue via grouped_light")
-            brightness_pct = round((brightness / 254) * 100, 2)
-            instant_state = {
-                "on": {"on": True},
-                "dimming": {"brightness": brightness_pct},
-                "color": {"xy": {"x": 0.1691, "y": 0.0441}},  # Blue
-                "dynamics": {"duration": 0}  # Instant
-            }
-            self.grouped_light_api.set_grouped_light_state(grouped_light_id, instant_state)
+            logger.debug("Setting all lights to blue via grouped_light")
+            self.grouped_light_api.set_grouped_light_state_raw(grouped_light_id, encode_state(color_state(BLUE_XY, brightness)))
 
-        # Create threads for each light
-        threads = []
+        # Serialize both color states once; every PUT during the effect reuses the bytes.
+        # Each toggle carries on/brightness too, so a light the instant start missed still joins in.
+        transition_ms = config.TRANSITION_TIME * 100
+        blue_body = encode_state(color_state(BLUE_XY, brightness, transition_ms))
+        yellow_body = encode_state(color_state(YELLOW_XY, brightness, transition_ms))
+
+        schedule = None
         stop_event = threading.Event()
         interrupted = False
 
+        if synchronized and not grouped_light_id:
+            logger.warning("No grouped_light available, falling back to desynchronized effect")
+            synchronized = False
+
+        # Draw every light's first-switch offset up front. Lights that share an
+        # offset form a cohort and are driven together.
+        if synchronized:
+            cohorts = {transition_interval: list(original_states)}
+        else:
+            rng = random.Random()
+            cohorts = {}
+            for light_id in original_states:
+                offset = rng.uniform(MIN_FIRST_COLOR_REDUCTION, MAX_FIRST_COLOR_REDUCTION)
+                cohorts.setdefault(offset, []).append(light_id)
+
         logger.info(f"Starting effect on '{group_name}': {len(original_states)} lights, {duration}s, {int(brightness/254*100)}% brightness")
 
+        # A single scheduler thread drives every light
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='randomizer')
+
         # Record effect start time for all threads to synchronize against
-        effect_start_time = time.time()
+        effect_start_ns = time.monotonic_ns()
 
-        try:
-            for light_id in light_ids:
-                if light_id in original_states:
-                    thread = threading.Thread(
-                        target=self.control_light,
-                        args=(light_id, duration, original_states[light_id], stop_event, effect_start_time, brightness, transition_interval)
-                    )
-                    thread.daemon = False
-                    thread.start()
-                    threads.append(thread)
-
-            # Wait for all threads to complete
-            logger.debug("Waiting for light threads to complete...")
-            for i, thread in enumerate(threads):
-                thread.join(timeout=duration + 10)  # Add buffer to timeout
-                if thread.is_alive():
-                    logger.warning(f"Thread {i+1}/{len(threads)} is still alive after timeout")
-
-        except KeyboardInterrupt:
-            interrupted = True
-            logger.warning("Interrupted! Stopping all lights and restoring state...")
-            stop_event.set()  # Signal all threads to stop
+        # SIGTERM (e.g. a cancelled Shortcut) stops the effect and restores
+        # lights the same way Ctrl+C does. Handlers can only be installed
+        # from the main thread.
+        terminated = threading.Event()
 
-        except Exception as e:
-            interrupted = True
-            logger.error(f"Unexpected error: {e}")
+        def handle_sigterm(signum, frame):
+            terminated.set()
             stop_event.set()
 
-        finally:
-            # Ensure all threads complete
-            logger.debug("Cleaning up threads...")
-            stop_event.set()
+        sigterm_installed = threading.current_thread() is threading.main_thread()
+        if sigterm_installed:
+            previous_sigterm = signal.signal(signal.SIGTERM, handle_sigterm)
 
-            for i, thread in enumerate(threads):
-                if thread.is_alive():
-                    logger.debug(f"Waiting for thread {i+1}/{len(threads)} to finish...")
-                    thread.join(timeout=5)
-                    if thread.is_alive():
-                        logger.error(f"Thread {i+1}/{len(threads)} did not finish after 5s timeout")
-
-            # Opportunistic batch restore: check if all lights had the same state
-            logger.debug(f"Restoring {len(original_states)} lights...")
-
-            # Check if all lights have the same color and brightness
-            states_list = list(original_states.values())
-            if len(states_list) > 0:
-                first_state = states_list[0]
-                first_on = first_state.get('on', {}).get('on', True)
-                first_brightness = first_state.get('dimming', {}).get('brightness', 100)
-                first_color = first_state.get('color', {}).get('xy', {})
-                first_ct = first_state.get('color_temperature', {}).get('mirek')
-
-                # Debug: check what's different
-                differences = []
-                for i, state in enumerate(states_list):
-                    if state.get('on', {}).get('on', True) != first_on:
-                        differences.append(f"Light {i}: on={state.get('on', {}).get('on')} vs {first_on}")
-                    if state.get('dimming', {}).get('brightness', 100) != first_brightness:
-                        differences.append(f"Light {i}: brightness={state.get('dimming', {}).get('brightness')} vs {first_brightness}")
-                    if state.get('color', {}).get('xy', {}) != first_color:
-                        differences.append(f"Light {i}: color xy={state.get('color', {}).get('xy')} vs {first_color}")
-                    if state.get('color_temperature', {}).get('mirek') != first_ct:
-                        differences.append(f"Light {i}: ct={state.get('color_temperature', {}).get('mirek')} vs {first_ct}")
-
-                if differences:
-                    logger.debug(f"State differences: {differences[:3]}")
-
-                all_same = len(differences) == 0
-
-                if all_same and grouped_light_id:
-                    # All lights had the same state - use batch restore!
-                    logger.debug("Using batch restore (all lights same state)")
-                    restore_state = {
-                        "on": {"on": first_on},
-                        "dimming": {"brightness": first_brightness},
-                        "dynamics": {"duration": 0}  # Instant restore
-                    }
-
-                    # Add color if available
-                    if first_color:
-                        restore_state["color"] = {"xy": {"x": first_color.get('x', 0.3), "y": first_color.get('y', 0.3)}}
-                    elif first_ct:
-                        restore_state["color_temperature"] = {"mirek": first_ct}
-
-                    try:
-                        self.grouped_light_api.set_grouped_light_state(grouped_light_id, restore_state)
-                        logger.debug("Batch restore completed")
-                    except Exception as e:
-                        logger.warning(f"Batch restore failed: {e}")
-                        # Fall back to individual restore
-                        for light_id, original_state in original_states.items():
-                            try:
-                                self.restore_light_state(light_id, original_state)
-                            except Exception as e:
-                                logger.error(f"Error restoring light {light_id}: {e}")
-                else:
-                    # Lights had different states - restore individually
-                    logger.debug("Restoring individually (lights had different states)")
-                    for light_id, original_state in original_states.items():
-                        try:
-                            self.restore_light_state(light_id, original_state)
-                        except Exception as e:
-                            logger.error(f"Error restoring light {light_id}: {e}")
+        try:
+            try:
+                schedule = executor.submit(
+                    self.run_schedule,
+                    cohorts, duration, stop_event, effect_start_ns, blue_body, yellow_body,
+                    grouped_light_id, transition_interval
+                )
+
+                # Wait for the scheduler to finish
+                logger.debug("Waiting for the effect schedule to complete...")
+                _, not_done = wait([schedule], timeout=duration + 10)  # Add buffer to timeout
+                if not_done:
+                    logger.warning("Effect schedule still running after timeout")
+
+                if terminated.is_set():
+                    interrupted = True
+                    logger.warning("Terminated! Stopping all lights and restoring state...")
+
+            except KeyboardInterrupt:
+                interrupted = True
+                logger.warning("Interrupted! Stopping all lights and restoring state...")
+                stop_event.set()  # Signal the scheduler to stop
+
+            except Exception as e:
+                interrupted = True
+                logger.error(f"Unexpected error: {e}")
+                stop_event.set()
+
+            finally:
+                # Ensure the scheduler completes
+                logger.debug("Stopping the effect schedule...")
+                stop_event.set()
+
+                if schedule is not None:
+                    _, not_done = wait([schedule], timeout=5)
+                    if not_done:
+                        logger.error("Effect schedule did not finish after 5s timeout")
+                    elif schedule.exception():
+                        logger.error(f"Effect schedule failed: {schedule.exception()}")
+                executor.shutdown(wait=False)
+
+                # Opportunistic batch restore: check if all lights had the same state
+                logger.debug("Restoring %d lights...", len(original_states))
+
+                # Check if all lights have the same color and brightness, stopping
+                # at the first light that differs
+                states = iter(original_states.values())
+                first_state = next(states, None)
+                if first_state is not None:
+                    first_key = _state_key(first_state)
+                    all_same = all(_state_key(state) == first_key for state in states)
+
+                    if not all_same and logger.isEnabledFor(logging.DEBUG):
+                        differences = [
+                            f"Light {light_id}: {_state_key(state)} vs {first_key}"
+                            for light_id, state in original_states.items()
+                            if _state_key(state) != first_key
+                        ]
+                        logger.debug("State differences (on, brightness, xy, mirek): %s", differences[:3])
+
+                    failed = []
+                    if all_same and grouped_light_id:
+                        # All lights had the same state - use batch restore!
+                        logger.debug("Using batch restore (all lights same state)")
+                        batch_state = restore_state(first_key)
+                        if self.grouped_light_api.set_grouped_light_state(grouped_light_id, batch_state):
+                            logger.debug("Batch restore completed")
+                        else:
+                            logger.warning("Batch restore failed, restoring individually")
+                            failed = self.restore_lights(original_states)
+                    else:
+                        # Lights had different states - restore individually
+                        logger.debug("Restoring individually (lights had different states)")
+                        failed = self.restore_lights(original_states)
+
+                    # Only lights whose restore request failed are checked again
+                    if failed:
+                        self.verify_restore({light_id: original_states[light_id] for light_id in failed})
+
+        finally:
+            # Put the previous handler back even if restoring the lights failed.
+            # signal.signal() returns None for handlers not installed from Python.
+            if sigterm_installed:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL if previous_sigterm is None else previous_sigterm)
 
         if interrupted:
             logger.warning("Effect was interrupted")
@@ -415,7 +595,7 @@ class HueRandomizer:
                 "error": "Effect was interrupted",
                 "group_id": group_id,
                 "group_name": group_name,
-                "lights_controlled": len(threads),
+                "lights_controlled": len(original_states),
                 "unreachable_lights": len(unreachable_lights),
                 "message": "All lights restored after interruption"
             }
@@ -426,7 +606,7 @@ class HueRandomizer:
             "group_id": group_id,
             "group_name": group_name,
             "duration": duration,
-            "lights_controlled": len(threads),
+            "lights_controlled": len(original_states),
             "unreachable_lights": len(unreachable_lights),
             "message": f"Randomizer effect completed on '{group_name}'"
         }
@@ -445,7 +625,6 @@ def main():
     import argparse
 
     logger.info("=== Randomizer script started ===")
-    randomizer = HueRandomizer()
 
     parser = argparse.ArgumentParser(description='The Randomizer - Philips Hue light effect')
     parser.add_argument('--zone', metavar='ZONE_ID', dest='zone_id',
@@ -462,12 +641,15 @@ def main():
                        help='Color change interval in seconds (default: 2, minimum: 1)')
     parser.add_argument('--grouped-light', metavar='GROUPED_LIGHT_ID', dest='grouped_light_id',
                        help='Grouped light ID for batch operations (optional, auto-detected if not provided)')
+    parser.add_argument('--sync', action='store_true',
+                       help='Switch all lights together with one grouped_light request per color change')
     parser.add_argument('--list', action='store_true', help='List available groups and exit')
 
     args = parser.parse_args()
 
     # Handle --list
     if args.list:
+        randomizer = HueRandomizer()
         print("Available groups (use ID with --zone or --room for fastest startup):")
         groups = randomizer.get_groups()
         for gid, data in groups.items():
@@ -497,8 +679,11 @@ def main():
 
     brightness = int((args.brightness / 100.0) * 254)
 
+    # Only set up the API clients once the arguments are known to be valid
+    randomizer = HueRandomizer()
+
     # Run the effect with optional grouped_light_id hint
-    result = randomizer.run_effect(group_input, args.duration, brightness, group_type, args.grouped_light_id, args.transition)
+    result = randomizer.run_effect(group_input, args.duration, brightness, group_type, args.grouped_light_id, args.transition, args.sync)
 
     # Print result as JSON for Shortcuts integration
     print(json.dumps(result, indent=2))